@@ -15,6 +15,8 @@ from io import open
 from time import time
 from tqdm import tqdm
 from math import pow, tanh
+from itertools import chain
+from scipy import sparse
 from .util import is_a_collection, Print, VERBOSITY, Preproc as Pp
 
 # python 2 and 3 compatibility
@@ -103,6 +105,7 @@ class SS3:
     __p_update__ = None
 
     __cv_cache__ = None
+    __cv_cache_a__ = None  # (a, __cv_cache__ with the values not greater than a set to 0)
     __last_x_test__ = None
     __last_x_test_idx__ = None
 
@@ -549,6 +552,52 @@ class SS3:
                 "wmv": wmv  # word max value
             }
 
+    def __classify_ready__(self, doc):
+        """Get the model ready to classify and return the (decoded) document."""
+        if not self.__categories__:
+            raise EmptyModelError
+
+        if self.__update_needed__():
+            self.update_values()
+
+        doc = doc or ''
+        try:
+            doc = doc.decode(ENCODING)
+        except UnicodeEncodeError:  # for python 2 compatibility
+            doc = doc.encode(ENCODING).decode(ENCODING)
+        except BaseException:
+            pass
+        return doc
+
+    def __classify_json__(self, doc, prep, prep_func=None):
+        """Classify the given document, yielding the (JSON) result of each paragraph."""
+        for parag in re_split_keep(self.__parag_delimiter__, doc):
+            if parag:
+                yield self.__classify_paragraph__(parag, prep=prep, prep_func=prep_func, json=True)
+
+    def __classify_json_summary__(self, pars_cv, pars_wmv):
+        """Return the (JSON) document result given its paragraphs' cv and wmv."""
+        nbr_cats = len(self.__categories__)
+        cv = self.summary_op_paragraphs(pars_cv)
+        max_v = max(cv)
+
+        if max_v > 1:
+            norm_cv = map(lambda x: x / max_v, cv)
+        else:
+            norm_cv = cv
+
+        norm_cv_sorted = sorted(
+            [(i, nv, cv[i]) for i, nv in enumerate(norm_cv)],
+            key=lambda e: -e[1]
+        )
+
+        return {
+            "cv": cv,
+            "wmv": reduce(vmax, pars_wmv),
+            "cvns": norm_cv_sorted,
+            "ci": [self.get_category_name(ic) for ic in xrange(nbr_cats)]
+        }
+
     def __trie_node__(self, ngram, icat):
         """Get the trie's node for this n-gram."""
         try:
@@ -791,6 +840,7 @@ class SS3:
 
     def __update_cv_cache__(self):
         """Update numpy darray confidence values cache."""
+        self.__cv_cache_a__ = None
         if self.__cv_cache__ is None:
             self.__cv_cache__ = np.zeros((len(self.__index_to_word__), len(self.__categories__)))
         cv = self.__cv__
@@ -843,15 +893,29 @@ class SS3:
                     if word_index(w) != IDX_UNKNOWN_WORD
                 ]
 
+        if self.__a__ > 0:
+            if self.__cv_cache_a__ is None or self.__cv_cache_a__[0] != self.__a__:
+                self.__cv_cache_a__ = (
+                    self.__a__, np.where(cv_cache > self.__a__, cv_cache, 0)
+                )
+            cv_cache = self.__cv_cache_a__[1]
+
+        # all the documents are classified at once by multiplying their
+        # (sparse) bag-of-words matrix by the confidence values matrix
+        docs_len = np.fromiter((len(doc) for doc in x_test_idx), dtype=np.int64)
+        x_test_bow = sparse.csr_matrix(
+            (
+                np.ones(docs_len.sum()),
+                np.fromiter(chain.from_iterable(x_test_idx), dtype=np.int64),
+                np.concatenate(([0], np.cumsum(docs_len)))
+            ),
+            shape=(len(x_test_idx), cv_cache.shape[0])
+        )
+        pred_cvs = x_test_bow.dot(cv_cache)
+
         y_pred = [None] * len(x_test)
-        for doc_idx, doc in enumerate(tqdm(x_test_idx, desc="Classification",
-                                           leave=leave_pbar, disable=Print.is_quiet())):
-            if self.__a__ > 0:
-                doc_cvs = cv_cache[doc]
-                doc_cvs[doc_cvs <= self.__a__] = 0
-                pred_cv = np.add.reduce(doc_cvs, 0)
-            else:
-                pred_cv = np.add.reduce(cv_cache[doc], 0)
+        for doc_idx, pred_cv in enumerate(tqdm(pred_cvs, desc="Classification",
+                                               leave=leave_pbar, disable=Print.is_quiet())):
 
             if proba:
                 y_pred[doc_idx] = list(pred_cv)
@@ -1940,6 +2004,7 @@ class SS3:
         :type update: bool
         """
         self.__cv_cache__ = None
+        self.__cv_cache_a__ = None
 
         if not doc or cat is None:
             return
@@ -2058,19 +2123,7 @@ class SS3:
         :rtype: list
         :raises: EmptyModelError
         """
-        if not self.__categories__:
-            raise EmptyModelError
-
-        if self.__update_needed__():
-            self.update_values()
-
-        doc = doc or ''
-        try:
-            doc = doc.decode(ENCODING)
-        except UnicodeEncodeError:  # for python 2 compatibility
-            doc = doc.encode(ENCODING).decode(ENCODING)
-        except BaseException:
-            pass
+        doc = self.__classify_ready__(doc)
 
         if not json:
             paragraphs_cvs = [
@@ -2092,33 +2145,103 @@ class SS3:
                 )
             return cv
         else:
-            info = [
-                self.__classify_paragraph__(parag, prep=prep, prep_func=prep_func, json=True)
-                for parag in re_split_keep(self.__parag_delimiter__, doc)
-                if parag
-            ]
+            info = list(self.__classify_json__(doc, prep=prep, prep_func=prep_func))
+            result = {"pars": info}
+            result.update(self.__classify_json_summary__(
+                [v["cv"] for v in info], [v["wmv"] for v in info]
+            ))
+            return result
 
-            nbr_cats = len(self.__categories__)
-            cv = self.summary_op_paragraphs([v["cv"] for v in info])
-            max_v = max(cv)
+    def classify_json_iter(self, doc, prep=True, prep_func=None, dumps=None):
+        """
+        Classify a given document, yielding its JSON result piece by piece.
 
-            if max_v > 1:
-                norm_cv = map(lambda x: x / max_v, cv)
-            else:
-                norm_cv = cv
+        The concatenation of the yielded pieces is the JSON serialization of
+        ``classify(doc, json=True)``, but the result of each paragraph is
+        yielded as soon as it is computed (and then discarded).
 
-            norm_cv_sorted = sorted(
-                [(i, nv, cv[i]) for i, nv in enumerate(norm_cv)],
-                key=lambda e: -e[1]
-            )
+        :param doc: the content of the document
+        :type doc: str
+        :param prep: enables the default input preprocessing (default: True)
+        :type prep: bool
+        :param prep_func: the custom preprocessing function to be applied to
+                          the given document before classifying it.
+                          If not given, the default preprocessing function will
+                          be used (as long as ``prep=True``)
+        :type prep_func: function
+        :param dumps: the function used to serialize each value to JSON
+                      (default: ``json.dumps``). If it returns bytes, so do
+                      the yielded pieces.
+        :type dumps: function
+        :returns: a generator of the JSON result pieces
+        :rtype: generator
+        :raises: EmptyModelError
+        """
+        dumps = dumps or json.dumps
+        text = (lambda s: s.encode()) if isinstance(dumps(0), bytes) else (lambda s: s)
+        doc = self.__classify_ready__(doc)
 
-            return {
-                "pars": info,
-                "cv": cv,
-                "wmv": reduce(vmax, [v["wmv"] for v in info]),
-                "cvns": norm_cv_sorted,
-                "ci": [self.get_category_name(ic) for ic in xrange(nbr_cats)]
-            }
+        yield text('{"pars":[')
+        pars_cv, pars_wmv = [], []
+        for parag in self.__classify_json__(doc, prep=prep, prep_func=prep_func):
+            yield text(',') + dumps(parag) if pars_cv else dumps(parag)
+            pars_cv.append(parag["cv"])
+            pars_wmv.append(parag["wmv"])
+
+        summary = self.__classify_json_summary__(pars_cv, pars_wmv)
+        yield text(']') + text('').join(
+            text(',"%s":' % key) + dumps(summary[key])
+            for key in ("cv", "wmv", "cvns", "ci")
+        ) + text('}')
+
+    def classify_many(self, x_test, prep=True, sort=True, prep_func=None, leave_pbar=True):
+        """
+        Classify a list of documents.
+
+        Equivalent to calling ``classify`` for each document but, when possible
+        (i.e. when no custom ``prep_func`` is given and only words were learned),
+        the documents are classified all at once using the faster ``predict`` method.
+
+        :param x_test: the list of documents to be classified
+        :type x_test: list (of str)
+        :param prep: enables the default input preprocessing (default: True)
+        :type prep: bool
+        :param sort: sort the classification results (from best to worst)
+        :type sort: bool
+        :param prep_func: the custom preprocessing function to be applied to
+                          each document before classifying it.
+                          If not given, the default preprocessing function will
+                          be used (as long as ``prep=True``)
+        :type prep_func: function
+        :param leave_pbar: controls whether to leave the progress bar or
+                           remove it after finishing.
+        :type leave_pbar: bool
+        :returns: the list of classification results, one for each document
+                  (as returned by ``classify``)
+        :rtype: list
+        :raises: EmptyModelError
+        """
+        if not self.__categories__:
+            raise EmptyModelError
+
+        if self.__update_needed__():
+            self.update_values()
+
+        x_test = list(x_test)
+        if prep_func is None and \
+           self.get_ngrams_length() == 1 and self.__summary_ops_are_pristine__():
+            cvs = self.__predict_fast__(x_test, prep=prep,
+                                        leave_pbar=leave_pbar, proba=True)
+            if not sort:
+                return cvs
+            return [sorted(enumerate(cv), key=lambda e: -e[1]) for cv in cvs]
+
+        classify = self.classify
+        return [
+            classify(doc, prep=prep, sort=sort, prep_func=prep_func)
+            for doc in tqdm(x_test, desc="Classification",
+                            leave=leave_pbar, disable=Print.is_quiet())
+        ]
 
     def classify_label(self, doc, def_cat=STR_MOST_PROBABLE, labels=True, prep=True):
         """
@@ -5,20 +5,29 @@ SS3 classification server with visual explanations for live tests.
 (Please, visit https://github.com/sergioburdisso/pyss3 for more info)
 """
 from __future__ import print_function
-from os import path, listdir
+from os import path, listdir, walk
 from io import open
 from tqdm import tqdm
-from select import select
 from datetime import datetime
+from collections import deque, OrderedDict
+from threading import Lock
+from hashlib import sha1
+from array import array
+from time import time
+from multiprocessing import cpu_count, Pool
+from multiprocessing.pool import ThreadPool
 
 from . import SS3, kmean_multilabel_size, __version__
 from .util import is_a_collection, membership_matrix, VERBOSITY
-from .util import Dataset, Print, RecursiveDefaultDict
+from .util import Dataset, Print
 
 import numpy as np
 import webbrowser
 import argparse
 import socket
+import signal
+import errno
+import os
 import json
 import re
 
@@ -27,20 +36,68 @@ try:
     from urllib.parse import unquote as url_decode
 except ImportError:
     from urllib import unquote as url_decode
+try:
+    import selectors
+except ImportError:
+    import selectors34 as selectors
+try:
+    from multiprocessing import get_context
+except ImportError:
+    get_context = None  # Python 2 (Pool always forks, on posix)
+
+# orjson is optional (a much faster JSON serializer)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 RECV_BUFFER = 1024 * 1024  # 1MB
+CONN_BUFFER = 64 * 1024  # 64KB (initial size of the per-connection receive buffer)
+SEND_BUFFER = 2 * 1024 * 1024  # 2MB (kernel send buffer of client connections)
+CHUNK_SIZE = 64 * 1024  # 64KB
+STREAM_DOC_SIZE = 16 * 1024  # 16KB (shorter documents are not streamed, but cached)
+CACHE_SIZE = 64 * 1024 * 1024  # 64MB (of cached classification results)
+MIN_DOCS_PER_PROCESS = 64
+KEEP_ALIVE_TIMEOUT = 5  # seconds
+HTTP_CONNECTION = {
+    True: "Connection: keep-alive\r\nKeep-Alive: timeout=%d\r\n" % KEEP_ALIVE_TIMEOUT,
+    False: "Connection: close\r\n"
+}
 HTTP_RESPONSE = ("HTTP/1.1 200 OK\r\n"
-                 "Connection: close\r\n"
+                 "%s"
                  "Access-Control-Allow-Origin: *\r\n"
                  "Server: SS3\r\n"
                  "Content-type: %s\r\n"
                  "Content-length: %d\r\n\r\n")
-HTTP_404 = ("HTTP/1.1 404 Not Found\r\n"
-            "Connection: close\r\n"
+HTTP_ASSET_RESPONSE = ("HTTP/1.1 200 OK\r\n"
+                       "%s"
+                       "Access-Control-Allow-Origin: *\r\n"
+                       "Server: SS3\r\n"
+                       "Cache-Control: no-cache\r\n"
+                       "ETag: %s\r\n"
+                       "Content-type: %s\r\n"
+                       "Content-length: %d\r\n\r\n")
+HTTP_304 = ("HTTP/1.1 304 Not Modified\r\n"
+            "%s"
             "Access-Control-Allow-Origin: *\r\n"
             "Server: SS3\r\n"
-            "Content-length: 0\r\n\r\n").encode()
+            "Cache-Control: no-cache\r\n"
+            "ETag: %s\r\n\r\n")
+HTTP_CHUNKED_RESPONSE = ("HTTP/1.1 200 OK\r\n"
+                         "%s"
+                         "Access-Control-Allow-Origin: *\r\n"
+                         "Server: SS3\r\n"
+                         "Content-type: %s\r\n"
+                         "Transfer-Encoding: chunked\r\n\r\n")
+HTTP_404 = dict(
+    (keep_alive, ("HTTP/1.1 404 Not Found\r\n"
+                  "%s"
+                  "Access-Control-Allow-Origin: *\r\n"
+                  "Server: SS3\r\n"
+                  "Content-length: 0\r\n\r\n" % connection).encode())
+    for keep_alive, connection in HTTP_CONNECTION.items()
+)
 CONTET_TYPE = {
     "html": "text/html",
     "css": "text/css",
@@ -53,6 +110,31 @@ CONTET_TYPE = {
 
 ENCODING = "utf-8"
 BASE_PATH = path.join(path.dirname(__file__), "resources/live_test")
+REGEX_CONTLENGTH = re.compile(br"Content-length\s*:\s*(\d+)", flags=re.IGNORECASE)
+REGEX_CONNECTION = re.compile(br"\r\nConnection[ \t]*:[ \t]*([\w-]+)", flags=re.IGNORECASE)
+REGEX_IF_NONE_MATCH = re.compile(br"\r\nIf-None-Match[ \t]*:[ \t]*([^\r\n]*)", flags=re.IGNORECASE)
+
+
+def json_default(obj):
+    """Return a serializable version of ``obj`` (used by ``json_dumps``)."""
+    if isinstance(obj, CategoryDocs):
+        return obj.to_dict()
+    if isinstance(obj, array):
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+if orjson is not None:
+    def json_dumps(data):
+        """Serialize ``data`` to a JSON-encoded bytes object."""
+        return orjson.dumps(
+            data, default=json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+else:
+    def json_dumps(data):
+        """Serialize ``data`` to a JSON-encoded bytes object."""
+        return json.dumps(data, default=json_default).encode(ENCODING)
 
 
 def main():
@@ -72,6 +154,10 @@ def main():
     parser.add_argument(
         '-p', '--port', type=int, default=0, help="the server port"
     )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help="the number of processes serving requests"
+    )
     parser.add_argument(
         '-q', '--quiet', help="quiet mode", action="store_true"
     )
@@ -102,7 +188,8 @@ def main():
             Server.set_testset_from_files_multilabel(args.path, args.path_labels)
 
     try:
-        Server.serve(port=args.port, browser=False, quiet=args.quiet)
+        Server.serve(port=args.port, browser=False, quiet=args.quiet,
+                     workers=args.workers)
     except IOError:
         Print.error("Error: port number already in use")
 
@@ -125,31 +212,175 @@ def parse_and_sanitize(rsc_path):
 
 
 def get_http_path(http_request):
-    """Given a HTTP request, return the resource path."""
-    return http_request.split('\n')[0].split(' ')[1]
+    """Given a (raw) HTTP request, return the resource path."""
+    return http_request.partition(b"\n")[0].split(b" ", 2)[1].decode(ENCODING)
 
 
 def get_http_body(http_request):
-    """Given a HTTP request, return the body."""
-    return http_request.split("\r\n\r\n")[1]
+    """Given a (raw) HTTP request, return the (raw) body."""
+    return http_request.partition(b"\r\n\r\n")[2]
+
+
+def _search_header(regex, http_request, headers_end=None):
+    """
+    Search for a header (using ``regex``) only within the request headers.
+
+    :param headers_end: the position where the headers end, i.e. of the
+                        first ``\r\n\r\n`` (if not given, it is searched for)
+    :type headers_end: int
+    :returns: the regex match object (or None)
+    """
+    if headers_end is None:
+        headers_end = http_request.find(b"\r\n\r\n")
+    return regex.search(
+        http_request, 0, headers_end if headers_end != -1 else len(http_request)
+    )
 
 
-def get_http_contlength(http_request):
-    """Given a HTTP request, return the Content-Length value."""
-    re_match = re.search(
-        r"Content-length\s*:\s*(\d+)", http_request,
-        flags=re.IGNORECASE
-    )
+def get_http_contlength(http_request, headers_end=None):
+    """Given a (raw) HTTP request, return the Content-Length value."""
+    re_match = _search_header(REGEX_CONTLENGTH, http_request, headers_end)
     return int(re_match.group(1)) if re_match else 0
 
 
+def get_http_length(http_request, headers_end=None):
+    """
+    Given a (raw) HTTP request, return its total length (headers and body).
+
+    :returns: the request length, or -1 if the headers are not complete
+    :rtype: int
+    """
+    if headers_end is None:
+        headers_end = http_request.find(b"\r\n\r\n")
+    if headers_end == -1:
+        return -1
+    return headers_end + 4 + get_http_contlength(http_request, headers_end)
+
+
+def get_http_connection(http_request, headers_end=None):
+    """Given a (raw) HTTP request, return the (lowercase) Connection value."""
+    re_match = _search_header(REGEX_CONNECTION, http_request, headers_end)
+    return re_match.group(1).decode("latin-1").lower() if re_match else ""
+
+
+def get_http_if_none_match(http_request, headers_end=None):
+    """Given a (raw) HTTP request, return the (raw) If-None-Match value."""
+    re_match = _search_header(REGEX_IF_NONE_MATCH, http_request, headers_end)
+    return re_match.group(1).strip() if re_match else b""
+
+
+def parse_http_request(http_request):
+    """
+    Parse the given (raw) HTTP request.
+
+    :returns: the method, the resource path, the HTTP version, the headers
+              (with lowercase names) and the position where the body starts.
+    :rtype: tuple
+    """
+    headers_end = http_request.find(b"\r\n\r\n")
+    if headers_end == -1:
+        headers_end = body_start = len(http_request)
+    else:
+        body_start = headers_end + 4
+
+    lines = http_request[:headers_end].split(b"\r\n")
+    method, rsc_path, version = lines[0].split(b" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower().decode("latin-1")] = value.strip().decode("latin-1")
+
+    return (method.decode("latin-1"), rsc_path.decode(ENCODING),
+            version.strip().decode("latin-1"), headers, body_start)
+
+
+def fork_pool(processes, initializer=None, initargs=()):
+    """
+    Return a pool of forked processes (or None if forking is not supported).
+
+    (The default start method, i.e. the global multiprocessing context,
+    is not changed).
+    """
+    if not hasattr(os, "fork"):
+        return None
+    if get_context is None:
+        return Pool(processes, initializer, initargs)
+    return get_context("fork").Pool(processes, initializer, initargs)
+
+
+def init_classify_worker(clf, prep_func):
+    """Initialize a worker process of the test documents classification pool."""
+    Print.set_verbosity(VERBOSITY.QUIET)
+    Server.__clf__ = clf
+    Server.__preprocess__ = prep_func
+
+
+def classify_worker(docs):
+    """Classify the given test documents (inside a worker process)."""
+    return Server.__clf__.classify_many(docs, prep_func=Server.__preprocess__)
+
+
+class CategoryDocs(object):
+    """The test documents of a category (and their classification results)."""
+
+    __slots__ = ("path", "file", "clf_result", "true_labels", "labels_recall")
+
+    def __init__(self):
+        """Class constructor."""
+        self.path = []
+        self.file = []
+        self.clf_result = array('i')
+        self.true_labels = None
+        self.labels_recall = None
+
+    def to_dict(self):
+        """Return a dict version of this object (to be serialized as JSON)."""
+        docs = {
+            "path": self.path,
+            "file": self.file,
+            "clf_result": self.clf_result
+        }
+        if self.true_labels is not None:
+            docs["true_labels"] = self.true_labels
+            docs["labels_recall"] = self.labels_recall
+        return docs
+
+
+class EventLoop(object):
+    """The state of a running server event loop (see ``Server.serve``)."""
+
+    __slots__ = ("selector", "pool", "requests", "keep_alive_socks", "wakeup_socks")
+
+    def __init__(self, threads):
+        """Class constructor."""
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPool(threads)  # request handlers
+        self.requests = {}  # (partially) received requests [buffer, size, start time, length] by fd
+        self.keep_alive_socks = deque()  # served connections (and buffers) to be watched again
+        self.wakeup_socks = socket.socketpair()  # to wake the loop up from the request handlers
+        self.wakeup_socks[0].setblocking(False)
+
+    def close(self):
+        """Release the event loop resources."""
+        self.selector.close()
+        for wakeup_sock in self.wakeup_socks:
+            wakeup_sock.close()
+        self.pool.terminate()
+
+
 class Server:
     """SS3's Live Test HTTP server class."""
 
     __port__ = 0  # any (free) port
     __clf__ = None
     __server_socket__ = None
-    __docs__ = RecursiveDefaultDict()
+    __workers__ = []  # process ids of the (child) worker processes
+    __serving__ = set()  # running event loops (i.e. serving requests)
+    __cache__ = OrderedDict()  # JSON classification results (least recently used first)
+    __cache_size__ = 0
+    __cache_lock__ = Lock()
+    __assets__ = {}  # static files (ETag, 304 and 200 HTTP headers, and body) cached by local path
+    __docs__ = {}  # test documents by category (CategoryDocs)
 
     __x_test__ = None
     __test_path__ = None
@@ -163,101 +394,321 @@ class Server:
     __default_cat__ = None
 
     @staticmethod
-    def __send_as_json__(sock, data):
-        """Send the data as a json string."""
-        data = json.dumps(data)
+    def __send_response__(sock, body, ext, keep_alive):
+        """Send the HTTP response (header and body) with a single call."""
         http_header = HTTP_RESPONSE % (
-            content_type("json"), len(data)
+            HTTP_CONNECTION[keep_alive], content_type(ext), len(body)
         )
-        sock.send(http_header.encode())
-        sock.send(data.encode(ENCODING))
+        sock.sendall(http_header.encode() + body)
 
     @staticmethod
-    def __recvall_body__(sock, data, length):
-        """Receive all HTTP message body."""
-        body = get_http_body(data)
-        while len(body) < length and data:
-            data = sock.recv(RECV_BUFFER).decode()
-            body += data
-        return url_decode(body)
+    def __send_as_json__(sock, data, keep_alive):
+        """Send the data as a json string."""
+        Server.__send_response__(sock, json_dumps(data), "json", keep_alive)
 
     @staticmethod
-    def __handle_request__(sock):
-        """Handle browser request."""
-        data = sock.recv(RECV_BUFFER)
+    def __cache_key__(doc):
+        """Return the classification results cache key for the given document."""
+        return (sha1(doc.encode(ENCODING)).digest(),
+                Server.__clf__.get_hyperparameters())
 
-        if not data:
+    @staticmethod
+    def __cache_get__(key):
+        """Return the cached classification result (or None if not cached)."""
+        with Server.__cache_lock__:
+            result = Server.__cache__.pop(key, None)
+            if result is not None:
+                Server.__cache__[key] = result  # now, the most recently used
+            return result
+
+    @staticmethod
+    def __cache_set__(key, result):
+        """Cache the given classification result, removing the least recently used ones."""
+        if len(result) > CACHE_SIZE:
             return
+        with Server.__cache_lock__:
+            if key in Server.__cache__:
+                return
+            Server.__cache__[key] = result
+            Server.__cache_size__ += len(result)
+            while Server.__cache_size__ > CACHE_SIZE:
+                Server.__cache_size__ -= len(Server.__cache__.popitem(last=False)[1])
+
+    @staticmethod
+    def __cache_clear__():
+        """Clear the classification results cache."""
+        with Server.__cache_lock__:
+            Server.__cache__ = OrderedDict()
+            Server.__cache_size__ = 0
+
+    @staticmethod
+    def __send_chunk__(sock, data, http_header=b''):
+        """
+        Send the data as a chunk (of a "Transfer-Encoding: chunked" response).
+
+        If given, ``http_header`` is sent first (along with the chunk).
+        """
+        sock.sendall(http_header + b"%x\r\n" % len(data) + data + b"\r\n")
+
+    @staticmethod
+    def __accept__(loop, server_socket):
+        """Accept a new client connection and wait for its request."""
+        try:
+            sockfd, addr = server_socket.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return  # already accepted by another worker process
+            raise
+        # don't delay small responses (Nagle) and keep large ones flowing
+        sockfd.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sockfd.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        Server.__watch__(loop, sockfd)
+        if Print.is_verbose():
+            Print.show(
+                Print.style.green("[ %s : %s ]")
+                % (addr[0], datetime.now())
+            )
+
+    @staticmethod
+    def __watch__(loop, sock, buffer=None, data=b''):
+        """
+        Wait for a new request on the given client connection.
+
+        ``data`` is the beginning of the request, if already received.
+        """
+        sock.setblocking(False)
+        if buffer is None:
+            buffer = bytearray(CONN_BUFFER)
+        while len(data) >= len(buffer):
+            buffer.extend(bytearray(len(buffer)))
+        buffer[:len(data)] = data
+        loop.requests[sock.fileno()] = [
+            buffer, len(data), time(), get_http_length(data) if data else -1
+        ]
+        loop.selector.register(sock, selectors.EVENT_READ, Server.__read_request__)
+
+    @staticmethod
+    def __wake_up__(loop, wakeup_sock):
+        """Watch again the connections kept alive by the request handlers."""
+        wakeup_sock.recv(RECV_BUFFER)
+        while loop.keep_alive_socks:
+            Server.__watch__(loop, *loop.keep_alive_socks.popleft())
+
+    @staticmethod
+    def __close_idle__(loop):
+        """Close the connections that have been waiting too long for a request."""
+        now = time()
+        for key in list(loop.selector.get_map().values()):
+            if key.data == Server.__read_request__:
+                if now - loop.requests[key.fd][2] > KEEP_ALIVE_TIMEOUT:
+                    loop.selector.unregister(key.fileobj)
+                    del loop.requests[key.fd]
+                    key.fileobj.close()
+
+    @staticmethod
+    def __read_request__(loop, sock):
+        """Read the available request data and handle it once complete."""
+        fd = sock.fileno()
+        request = loop.requests[fd]
+        buffer, size = request[0], request[1]
+        try:
+            nbytes = sock.recv_into(memoryview(buffer)[size:])
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            nbytes = 0
+
+        request[1] = size + nbytes
+        if nbytes:
+            # the request is only handed to a worker thread once fully received
+            # (headers and body), so that no thread waits on a slow client
+            length = request[3]
+            if length == -1:
+                headers_end = buffer.find(b"\r\n\r\n", max(0, size - 3), size + nbytes)
+                if headers_end != -1:
+                    length = request[3] = get_http_length(buffer, headers_end)
+                elif size + nbytes >= RECV_BUFFER:  # headers too long
+                    length = size + nbytes
+            if length == -1 or size + nbytes < length:
+                if size + nbytes == len(buffer):  # buffer full
+                    buffer.extend(bytearray(max(len(buffer), length - len(buffer))))
+                return
 
+        loop.selector.unregister(sock)
+        del loop.requests[fd]
+        if nbytes:
+            data = bytes(buffer[:size + nbytes])
+            loop.pool.apply_async(Server.__serve_request__, (loop, sock, data, buffer))
+        else:
+            sock.close()
+
+    @staticmethod
+    def __serve_request__(loop, sock, data, buffer=None):
+        """Handle the (complete) request and then either close or keep the connection."""
+        keep_alive = False
         try:
-            data = data.decode()
-        except UnicodeDecodeError:
-            Print.error("UnicodeDecodeError: __handle_request__")
+            sock.settimeout(KEEP_ALIVE_TIMEOUT)  # (for sending the response)
+            while True:
+                keep_alive, request_length = Server.__handle_request__(sock, data)
+                # the data following the request belongs to the next (pipelined) one,
+                # handled right away only if already complete
+                data = data[request_length:]
+                if not keep_alive or not 0 < get_http_length(data) <= len(data):
+                    break
+        except Exception as e:
+            keep_alive = False
+            Print.error("Exception: " + str(e))
+
+        if keep_alive:
+            loop.keep_alive_socks.append((sock, buffer, data))
+            try:
+                loop.wakeup_socks[1].send(b'\0')
+            except socket.error:  # the server was closed
+                sock.close()
+        else:
+            sock.close()
 
-        rsc_path = get_http_path(data)
+    @staticmethod
+    def __handle_request__(sock, data):
+        """
+        Handle browser request.
 
-        if data.startswith("POST"):
-            Print.show("\tPOST %s" % rsc_path)
+        :returns: whether the connection is kept alive and the length of the
+                  request (in ``data``)
+        :rtype: tuple
+        """
+        if not data:
+            return False, 0
+
+        if data.startswith(b"GET "):
+            # fast path: only the request line and a few headers (Connection and
+            # If-None-Match) are needed
+            method, rsc_path, version = data.partition(b"\r\n")[0].split(b" ", 2)
+            method, rsc_path = "GET", rsc_path.decode(ENCODING)
+            version = version.strip().decode("latin-1")
+            headers_end = data.find(b"\r\n\r\n")
+            connection = get_http_connection(data, headers_end)
+            request_length = get_http_length(data, headers_end) if headers_end != -1 else len(data)
+        else:
+            method, rsc_path, version, headers, body_start = parse_http_request(data)
+            connection = headers.get("connection", "").lower()
+            request_length = body_start
+            headers_end = None  # (i.e. to be searched for, if needed)
+
+        # persistent connections are the default only since HTTP/1.1
+        keep_alive = connection == "keep-alive" or (
+            version == "HTTP/1.1" and connection != "close"
+        )
+
+        # avoid formatting log messages (and writing them) when not verbose
+        verbose = Print.is_verbose()
+
+        if method == "POST":
+            if verbose:
+                Print.show("\tPOST %s" % rsc_path)
             method = rsc_path[1:]
 
-            cont_length = get_http_contlength(data)
-            body = Server.__recvall_body__(sock, data, cont_length)
+            cont_length = int(headers.get("content-length", 0))
+            request_length += cont_length
+            body = url_decode(data[body_start:request_length].decode(ENCODING))
 
             if method == "ack":
-                Server.__do_ack__(sock)
+                Server.__do_ack__(sock, keep_alive)
             elif method == "classify":
-                Server.__do_classify__(sock, body)
+                # chunked transfer encoding is only supported since HTTP/1.1
+                Server.__do_classify__(sock, body, keep_alive, version == "HTTP/1.1")
             elif method == "get_info":
-                Server.__do_get_info__(sock)
+                Server.__do_get_info__(sock, keep_alive)
             elif method == "get_doc":
-                Server.__do_get_doc__(sock, body)
+                Server.__do_get_doc__(sock, body, keep_alive)
             else:
-                sock.send(HTTP_404)
-                Print.info("404 Not Found")
+                sock.sendall(HTTP_404[keep_alive])
+                if verbose:
+                    Print.info("404 Not Found")
 
         else:  # if GET
-            Print.show("\tGET %s " % rsc_path, False)
-
-            local_path, ext = parse_and_sanitize(rsc_path)
-            if path.exists(local_path):
-                with open(local_path, 'rb') as fresponse:
-                    http_body = fresponse.read()
-                    http_header = HTTP_RESPONSE % (
-                        content_type(ext), len(http_body)
-                    )
-                    sock.send(http_header.encode())
-                    sock.send(http_body)
-                    Print.info("200 OK")
+            local_path, _ = parse_and_sanitize(rsc_path)
+            asset = Server.__assets__.get(path.normpath(local_path))
+            if asset is not None:
+                etag, http_headers_304, http_headers, http_body = asset
+                if_none_match = get_http_if_none_match(data, headers_end)
+                if if_none_match and (etag in if_none_match or if_none_match == b"*"):
+                    sock.sendall(http_headers_304[keep_alive])  # the browser's copy is up to date
+                    status = "304 Not Modified"
+                else:
+                    sock.sendall(http_headers[keep_alive] + http_body)
+                    status = "200 OK"
             else:
-                sock.send(HTTP_404)
-                Print.info("404 Not Found")
+                sock.sendall(HTTP_404[keep_alive])
+                status = "404 Not Found"
+
+            if verbose:  # a single write, so that lines from different threads don't mix
+                Print.show("\tGET %s %s" % (rsc_path, Print.style.blue("[ %s ]" % status)))
+
+        return keep_alive, request_length
 
     @staticmethod
-    def __do_ack__(sock):
+    def __do_ack__(sock, keep_alive):
         """Serve the 'ack' message."""
-        http_header = HTTP_RESPONSE % (content_type(''), 0)
-        sock.send(http_header.encode())
+        Server.__send_response__(sock, b'', '', keep_alive)
         Print.info("sending ACK back to client...")
 
     @staticmethod
-    def __do_classify__(sock, doc):
-        """Serve the 'classify' message."""
-        try:
+    def __do_classify__(sock, doc, keep_alive, stream=True):
+        """
+        Serve the 'classify' message.
+
+        If ``stream`` is True, the result of long documents is sent as it is
+        computed, paragraph by paragraph, using "Transfer-Encoding: chunked"
+        (these results are not cached, only shorter ones are).
+        """
+        clf = Server.__clf__
+        if Print.is_verbose():
             Print.show("\t%s[...]" % doc[:50])
-            Server.__send_as_json__(
-                sock,
-                Server.__clf__.classify(
-                    doc,
-                    prep=Server.__default_prep__,
-                    prep_func=Server.__preprocess__,
-                    json=True)
-            )
+
+        if not stream or len(doc) < STREAM_DOC_SIZE:
+            cache_key = Server.__cache_key__(doc)
+            result = Server.__cache_get__(cache_key)
+            if result is not None:
+                Server.__send_response__(sock, result, "json", keep_alive)
+                Print.info("sending (cached) classification result...")
+                return
+
+            result = json_dumps(clf.classify(
+                doc,
+                prep=Server.__default_prep__,
+                prep_func=Server.__preprocess__,
+                json=True
+            ))
+            Server.__send_response__(sock, result, "json", keep_alive)
             Print.info("sending classification result...")
-        except Exception as e:
-            Print.error(str(e))
+            Server.__cache_set__(cache_key, result)
+            return
+
+        # not sent until the first chunk is ready, so that errors can still
+        # close the connection without a (truncated) successful response
+        http_header = (HTTP_CHUNKED_RESPONSE % (
+            HTTP_CONNECTION[keep_alive], content_type("json")
+        )).encode()
+
+        chunk, chunk_size = [], 0
+        for data in clf.classify_json_iter(doc, prep=Server.__default_prep__,
+                                           prep_func=Server.__preprocess__,
+                                           dumps=json_dumps):
+            chunk.append(data)
+            chunk_size += len(data)
+            if chunk_size >= CHUNK_SIZE:
+                Server.__send_chunk__(sock, b''.join(chunk), http_header)
+                http_header = b''
+                chunk, chunk_size = [], 0
+
+        if chunk:
+            Server.__send_chunk__(sock, b''.join(chunk), http_header)
+        sock.sendall(b"0\r\n\r\n")
+        Print.info("sending classification result...")
 
     @staticmethod
-    def __do_get_info__(sock):
+    def __do_get_info__(sock, keep_alive):
         """Serve the 'get_info' message."""
         clf = Server.__clf__
         Server.__send_as_json__(sock, {
@@ -267,11 +718,11 @@ class Server:
             "categories": clf.get_categories(all=True) + ["[unknown]"],
             "docs": Server.__docs__,
             "def_cat": Server.__default_cat__
-        })
+        }, keep_alive)
         Print.info("sending classifier info...")
 
     @staticmethod
-    def __do_get_doc__(sock, file):
+    def __do_get_doc__(sock, file, keep_alive):
         """Serve the 'get_doc' message."""
         doc = ""
         if ":x_test:" in file:
@@ -282,13 +733,122 @@ class Server:
             with open(file, 'r', encoding=ENCODING) as fdoc:
                 doc = fdoc.read()
 
-        Server.__send_as_json__(sock, {"content": doc})
+        Server.__send_as_json__(sock, {"content": doc}, keep_alive)
         Print.info("sending document content...")
 
+    @staticmethod
+    def __listen__(port, reuse_port=False):
+        """Create a new (non-blocking) socket listening on the given port."""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server_socket.bind(("0.0.0.0", port))
+        server_socket.listen(128)
+        server_socket.setblocking(False)
+        return server_socket
+
+    @staticmethod
+    def __fork_workers__(server_socket, workers):
+        """
+        Fork ``workers - 1`` child processes to serve requests too.
+
+        :param server_socket: the socket the server is listening on
+        :type server_socket: socket.socket
+        :returns: the socket to serve requests from, in the child (worker)
+                  processes, None in the parent
+        :rtype: socket.socket
+        """
+        if not hasattr(os, "fork"):
+            Print.warn("multiple workers are not supported on this platform")
+            return None
+
+        for _ in range(workers - 1):
+            pid = os.fork()
+            if pid == 0:  # child process
+                Server.__workers__ = []
+                if hasattr(socket, "SO_REUSEPORT") and \
+                   server_socket.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT):
+                    # each worker listens on its own socket and the kernel
+                    # distributes the incoming connections among them
+                    server_socket.close()
+                    server_socket = Server.__listen__(Server.__port__, True)
+                    Server.__server_socket__ = server_socket
+                return server_socket
+            Server.__workers__.append(pid)
+        return None
+
+    @staticmethod
+    def __stop_workers__():
+        """Terminate the worker processes and wait for them to exit."""
+        for pid in Server.__workers__:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:  # already finished
+                pass
+        Server.__workers__ = []
+
+    @staticmethod
+    def __preload_assets__():
+        """Cache the static files to be served (along with their HTTP header)."""
+        Server.__assets__ = {}
+        for root, _, files in walk(BASE_PATH):
+            for file in files:
+                local_path = path.normpath(path.join(root, file))
+                with open(local_path, 'rb') as fasset:
+                    http_body = fasset.read()
+                ext = path.splitext(file)[1][1:]
+                etag = '"%s"' % sha1(http_body).hexdigest()
+                http_headers_304 = dict(
+                    (keep_alive, (HTTP_304 % (connection, etag)).encode())
+                    for keep_alive, connection in HTTP_CONNECTION.items()
+                )
+                http_headers = dict(
+                    (keep_alive, (HTTP_ASSET_RESPONSE % (
+                        connection, etag, content_type(ext), len(http_body)
+                    )).encode())
+                    for keep_alive, connection in HTTP_CONNECTION.items()
+                )
+                Server.__assets__[local_path] = (
+                    etag.encode(), http_headers_304, http_headers, http_body
+                )
+
+    @staticmethod
+    def __classify_docs__(docs, leave_pbar=True):
+        """
+        Classify the test documents (using multiple processes, if possible).
+
+        Processes are only used when they can be forked (so that the model
+        doesn't need to be sent to each one of them) and the server is not
+        serving requests, since forking a process with other threads running
+        (those of the server) could end in a deadlock.
+        """
+        clf, prep_func = Server.__clf__, Server.__preprocess__
+        processes = min(cpu_count(), len(docs) // MIN_DOCS_PER_PROCESS)
+
+        pool = None
+        if processes > 1 and not Server.__serving__:
+            pool = fork_pool(processes, init_classify_worker, (clf, prep_func))
+        if pool is not None:
+            chunksize = max(1, len(docs) // (processes * 4))
+            chunks = [docs[i:i + chunksize] for i in range(0, len(docs), chunksize)]
+            try:
+                results = []
+                for chunk_results in tqdm(pool.imap(classify_worker, chunks),
+                                          desc=" Classifying docs", total=len(chunks),
+                                          leave=leave_pbar, disable=Print.is_quiet()):
+                    results.extend(chunk_results)
+                return results
+            finally:
+                pool.terminate()
+
+        return clf.classify_many(docs, prep_func=prep_func, leave_pbar=leave_pbar)
+
     @staticmethod
     def __clear_testset__():
         """Clear server's test documents."""
-        Server.__docs__ = RecursiveDefaultDict()
+        Server.__docs__ = {}
         Server.__test_path__ = None
         Server.__test_path_prev__ = None
         Server.__folder_label__ = None
@@ -319,38 +879,37 @@ class Server:
                     doc_i = 0
                     for doc_name in doc_raw_names:
                         doc_name += ".txt"
-                        if doc_i == 0 or docs["file"][doc_i - 1] != doc_name:
-                            docs["file"][doc_i] = doc_name
-                            docs["path"][doc_i] = path.join(docs_path, doc_name)
+                        if doc_i == 0 or docs.file[doc_i - 1] != doc_name:
+                            docs.file[doc_i] = doc_name
+                            docs.path[doc_i] = path.join(docs_path, doc_name)
                             doc_i += 1
         else:
-            classify = Server.__clf__.classify
             unkwon_cat_i = len(Server.__clf__.get_categories())
             if not Server.__folder_label__:
                 x_test, y_test = Dataset.load_from_files(Server.__test_path__, False,
                                                          sep_doc=Server.__sep_doc__)
                 Server.set_testset(x_test, y_test)
             else:
+                cats, files, paths, docs = [], [], [], []
                 for cat in listdir(Server.__test_path__):
                     cat_path = path.join(Server.__test_path__, cat)
                     if not path.isfile(cat_path):
-                        Server.__docs__[cat]["path"] = []
-                        Server.__docs__[cat]["file"] = []
-                        Server.__docs__[cat]["clf_result"] = []
-                        for file in tqdm(sorted(listdir(cat_path)),
-                                         desc=" Classifying '%s' docs" % cat,
-                                         disable=Print.is_quiet()):
+                        for file in sorted(listdir(cat_path)):
                             file_path = path.join(cat_path, file)
                             if path.isfile(file_path):
-                                Server.__docs__[cat]["path"].append(file_path)
-                                Server.__docs__[cat]["file"].append(file)
-                                with open(
-                                    file_path, "r", encoding=ENCODING
-                                ) as fdoc:
-                                    r = classify(fdoc.read(), prep_func=Server.__preprocess__)
-                                    Server.__docs__[cat]["clf_result"].append(
-                                        r[0][0] if r[0][1] else unkwon_cat_i
-                                    )
+                                with open(file_path, "r", encoding=ENCODING) as fdoc:
+                                    docs.append(fdoc.read())
+                                cats.append(cat)
+                                files.append(file)
+                                paths.append(file_path)
+                        Server.__docs__[cat] = CategoryDocs()
+
+                results = Server.__classify_docs__(docs)
+                for cat, file, file_path, r in zip(cats, files, paths, results):
+                    cat_docs = Server.__docs__[cat]
+                    cat_docs.path.append(file_path)
+                    cat_docs.file.append(file)
+                    cat_docs.clf_result.append(r[0][0] if r[0][1] else unkwon_cat_i)
 
             Print.info("%d categories found" % len(Server.__docs__))
         return len(Server.__docs__) > 0
@@ -375,6 +934,7 @@ class Server:
         """
         Server.__clf__ = clf
         Server.__clear_testset__()
+        Server.__cache_clear__()
 
     @staticmethod
     def set_testset(x_test, y_test=None, def_cat=None):
@@ -399,7 +959,6 @@ class Server:
         Server.__x_test__ = x_test
         Server.__default_cat__ = clf.__get_def_cat__(def_cat)
 
-        classify = clf.classify
         docs = Server.__docs__
         unkwon_cat_i = len(Server.__clf__.get_categories())
         no_y_test = y_test is None
@@ -411,30 +970,20 @@ class Server:
             y_test = [""]
 
         for cat in set(y_test):
-            docs[cat]["path"] = []
-            docs[cat]["file"] = []
-            docs[cat]["clf_result"] = []
+            docs[cat] = CategoryDocs()
 
-        for idoc, doc in enumerate(x_test):
+        for idoc in range(len(x_test)):
             cat = y_test[0] if no_y_test or multilabel else y_test[idoc]
-            doc_name = "doc_%d" % idoc
+            cat_docs = docs[cat]
+            cat_docs.file.append("doc_%d" % idoc)
+            cat_docs.path.append(":x_test:%d" % idoc)
 
-            docs[cat]["file"].append(doc_name)
-            docs[cat]["path"].append(":x_test:%d" % idoc)
-
-            if multilabel:
-                docs[cat]["clf_result"].append(
-                    classify(doc, prep_func=Server.__preprocess__)
-                )
-            elif not no_y_test:
-                res = classify(doc, prep_func=Server.__preprocess__)
-                docs[cat]["clf_result"].append(
-                    res[0][0] if res[0][1] else unkwon_cat_i
-                )
+        if not no_y_test:
+            results = Server.__classify_docs__(x_test, leave_pbar=False)
 
         if multilabel:
             y_pred = [[ci for ci, _ in r[:kmean_multilabel_size(r)]]
-                      for r in docs[y_test[0]]["clf_result"]]
+                      for r in results]
             if Server.__default_cat__ is not None:
                 y_pred = [labels if labels else [clf.get_category_index(Server.__default_cat__)]
                           for labels in y_pred]
@@ -443,10 +992,14 @@ class Server:
             np.seterr(divide='ignore', invalid='ignore')
             accuracy = (t & p).sum(axis=1) / (t | p).sum(axis=1)
             accuracy[np.isnan(accuracy)] = 1
-            docs[y_test[0]]["true_labels"] = y_test_labels
-            docs[y_test[0]]["labels_recall"] = accuracy.reshape(-1).tolist()[0]
-            docs[y_test[0]]["clf_result"] = [r[0][0] if r[0][1] else unkwon_cat_i
-                                             for r in docs[cat]["clf_result"]]
+            cat_docs = docs[""]
+            cat_docs.true_labels = y_test_labels
+            cat_docs.labels_recall = accuracy.reshape(-1).tolist()[0]
+            cat_docs.clf_result.extend(r[0][0] if r[0][1] else unkwon_cat_i
+                                       for r in results)
+        elif not no_y_test:
+            for idoc, r in enumerate(results):
+                docs[y_test[idoc]].clf_result.append(r[0][0] if r[0][1] else unkwon_cat_i)
 
         if not no_y_test and not multilabel:
             Print.info("%d categories found" % len(docs))
@@ -527,7 +1080,7 @@ class Server:
         Server.__sep_label__ = sep_label
 
     @staticmethod
-    def start_listening(port=0):
+    def start_listening(port=0, workers=1):
         """
         Start listening on a port and return its number.
 
@@ -535,14 +1088,26 @@ class Server:
 
         :param port: the port to listen on
         :type port: int
+        :param workers: the number of processes that will serve requests
+                        (default: 1)
+        :type workers: int
         """
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind(("0.0.0.0", port))
-        server_socket.listen(128)
+        Server.__start_listening__(port, workers)
+        return Server.__port__
+
+    @staticmethod
+    def __start_listening__(port=0, workers=1):
+        """Start listening on a port and return the (listening) socket."""
+        server_socket = Server.__listen__(
+            port, workers > 1 and hasattr(socket, "SO_REUSEPORT")
+        )
 
         Server.__server_socket__ = server_socket
         Server.__port__ = server_socket.getsockname()[1]
 
+        if not Server.__assets__:
+            Server.__preload_assets__()
+
         Print.info(
             "Live Test server started (listening on port %d)" % Server.__port__,
             force_show=True
@@ -555,12 +1120,12 @@ class Server:
         )
         Print.warn("Press Ctrl+C to stop the server\n")
 
-        return Server.__port__
+        return server_socket
 
     @staticmethod
     def serve(
         clf=None, x_test=None, y_test=None, port=0, browser=True,
-        quiet=True, prep=True, prep_func=None, def_cat=None
+        quiet=True, prep=True, prep_func=None, def_cat=None, workers=1
     ):
         """
         Wait for classification requests and serve them.
@@ -593,19 +1158,25 @@ class Server:
                         (default: "most-probable", or "unknown" for
                          multi-label classification)
         :type def_cat: str
+        :param workers: the number of processes that will serve requests
+                        (only on platforms supporting ``fork``) (default: 1)
+        :type workers: int
         :raises: ValueError
         """
         clf = clf or Server.__clf__
         Server.__clf__ = clf
         Server.__preprocess__ = prep_func
         Server.__default_prep__ = prep
+        Server.__cache_clear__()
 
         if not Server.__clf__:
             Print.error("a model must be given before serving")
             return
 
-        if Server.__server_socket__ is None:
-            Server.start_listening(port)
+        # (kept locally, since other threads could also be starting or stopping the server)
+        server_socket = Server.__server_socket__
+        if server_socket is None:
+            server_socket = Server.__start_listening__(port, workers)
 
         if x_test is not None:
             if y_test is None or len(y_test) == len(x_test):
@@ -616,10 +1187,16 @@ class Server:
         elif Server.__test_path__ and Server.__test_path_prev__ != Server.__test_path__:
             Server.__load_testset_from_files__()
 
-        server_socket = Server.__server_socket__
-        clients = [server_socket]
+        worker_socket = Server.__fork_workers__(server_socket, workers) if workers > 1 else None
+        is_worker = worker_socket is not None
+        server_socket = worker_socket or server_socket
 
-        if browser:
+        # the state of this event loop (forked workers have their own)
+        loop = EventLoop(max(2, cpu_count()))
+        loop.selector.register(server_socket, selectors.EVENT_READ, Server.__accept__)
+        loop.selector.register(loop.wakeup_socks[0], selectors.EVENT_READ, Server.__wake_up__)
+
+        if browser and not is_worker:
             webbrowser.open("http://localhost:%d" % Server.__port__)
 
         if quiet:
@@ -627,39 +1204,37 @@ class Server:
         else:
             Print.verbosity_region_begin(VERBOSITY.VERBOSE)
 
-        Print.info("waiting for requests")
-        print()
+        if not is_worker:
+            Print.info("waiting for requests")
+            print()
 
+        last_sweep = time()
+        Server.__serving__.add(loop)
         try:
             while True:
                 try:
-                    read_socks, write_socks, error_socks = select(clients, [], [])
-
-                    for sock in error_socks:
-                        clients.remove(sock)
-
-                    for sock in read_socks:
-                        if sock is server_socket:
-                            sockfd, addr = server_socket.accept()
-                            clients.append(sockfd)
-                            Print.show(
-                                Print.style.green("[ %s : %s ]")
-                                % (addr[0], datetime.now())
-                            )
-                        else:
-                            Server.__handle_request__(sock)
-                            clients.remove(sock)
-                            sock.close()
-
+                    for key, _ in loop.selector.select(timeout=1):
+                        key.data(loop, key.fileobj)
+                    if time() - last_sweep >= 1:  # at most once per second
+                        Server.__close_idle__(loop)
+                        last_sweep = time()
                 except Exception as e:
                     Print.error("Exception: " + str(e))
         except KeyboardInterrupt:
-            Print.info("closing server...")
+            if not is_worker:
+                Print.info("closing server...")
+            loop.close()
             server_socket.close()
-            Server.__server_socket__ = None
+            if Server.__server_socket__ is server_socket:
+                Server.__server_socket__ = None
 
             if quiet:
                 Print.verbosity_region_end()
+        finally:
+            Server.__serving__.discard(loop)
+            if is_worker:
+                os._exit(0)  # worker processes must never return to the caller's code
+            Server.__stop_workers__()
 
 
 # more user-friendly aliases
@@ -60,7 +60,8 @@ if __name__ == "__main__":
                             'scikit-learn[alldeps]>=0.20',
                             'tqdm>=4.8.4',
                             'matplotlib',
-                            'iterative-stratification'],
+                            'iterative-stratification',
+                            'selectors34; python_version < "3.4"'],
           tests_require=['pytest',
                          'pytest-mock'
                          'pytest-cov>=2.5'
@@ -71,5 +72,6 @@ if __name__ == "__main__":
                          'scikit-learn[alldeps]>=0.20',
                          'tqdm>=4.8.4',
                          'matplotlib',
-                         'iterative-stratification'],
+                         'iterative-stratification',
+                         'selectors34; python_version < "3.4"'],
           entry_points={'console_scripts': ['pyss3=pyss3.cmd_line:main']})
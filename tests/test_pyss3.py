@@ -10,6 +10,7 @@ from pyss3 import \
     PARA_DELTR, SENT_DELTR, WORD_DELTR, VERBOSITY
 
 import sys
+import json
 import pyss3
 import pytest
 
@@ -102,6 +103,12 @@ def perform_tests_with(clf, cv_test, stopwords=True):
     clf.set_a(.1)
     y_pred = clf.predict(x_test)
     assert y_pred == y_test
+    if clf.get_ngrams_length() == 1 and clf.__summary_ops_are_pristine__():
+        cv_cache_a = clf.__cv_cache_a__[1]  # (computed only once)
+        assert clf.predict(x_test) == y_pred and clf.__cv_cache_a__[1] is cv_cache_a
+        clf.set_a(.2)
+        clf.predict(x_test)
+        assert clf.__cv_cache_a__[0] == .2 and (clf.__cv_cache_a__[1] <= cv_cache_a).all()
     clf.set_a(0)
     y_pred = clf.predict(x_test, multilabel=True)
     assert y_pred == [[y] for y in y_test]
@@ -150,6 +157,14 @@ def perform_tests_with(clf, cv_test, stopwords=True):
     assert pred1[0][0] == clf.get_category_index(y_test[0])
     assert argmax(pred0) == pred1[0][0] and pred0[argmax(pred0)] == pred1[0][1]
 
+    # classify_many
+    preds = clf.classify_many(x_test)
+    assert [pred[0][0] for pred in preds] == [argmax(clf.classify(doc, sort=False))
+                                              for doc in x_test]
+    preds = clf.classify_many(x_test[:1], sort=False, prep_func=lambda doc: doc.lower())
+    assert argmax(preds[0]) == clf.get_category_index(y_test[0])
+    assert clf.classify_many([]) == []
+
     # classify_label
     assert clf.classify_label(x_test[0]) == y_test[0]
     assert clf.classify_label(x_test[0], labels=False) == clf.get_category_index(y_test[0])
@@ -214,6 +229,12 @@ def perform_tests_with(clf, cv_test, stopwords=True):
     clf.set_block_delimiters(word="-")
     pred = clf.classify(doc_blocks1, json=True)
     assert len(pred["pars"][0]["sents"][0]["words"]) == 5  # 3 words + 2 delimiters
+
+    # classify_json_iter
+    assert json.loads("".join(clf.classify_json_iter(doc_blocks1))) == json.loads(json.dumps(pred))
+    assert json.loads(b"".join(clf.classify_json_iter(
+        doc_blocks1, dumps=lambda v: json.dumps(v).encode()
+    ))) == json.loads(json.dumps(pred))
     clf.set_block_delimiters(parag=PARA_DELTR, sent=SENT_DELTR, word=WORD_DELTR)
 
 
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 """Tests for pyss3.server."""
 import pyss3.server as s
+import multiprocessing
 import threading
+import subprocess
 import argparse
+import signal
 import socket
 import pytest
 import pyss3
 import json
+import time
 import sys
+import os
 
 from os import path
 from pyss3 import SS3
@@ -21,6 +26,19 @@ DATASET_FOLDER = "dataset"
 DATASET_FOLDER_MR = "dataset_mr"
 DATASET_MULTILABEL_FOLDER = "dataset_ml"
 ADDRESS, PORT = "localhost", None
+WORKERS_SCRIPT = """
+import signal
+from pyss3 import SS3, set_verbosity
+from pyss3.server import Live_Test
+
+signal.signal(signal.SIGINT, signal.default_int_handler)
+set_verbosity(0)
+clf = SS3()
+clf.fit(["android mobile phone", "soccer football match"], ["tech", "sports"])
+print("PORT %d" % Live_Test.start_listening(workers=3), flush=True)
+Live_Test.serve(clf, browser=False, workers=3)
+print("AFTER SERVE", flush=True)
+"""
 LT = s.Live_Test
 
 dataset_path = path.join(path.abspath(path.dirname(__file__)), DATASET_FOLDER)
@@ -52,6 +70,7 @@ class MockCmdLineArgs:
     path_labels = None
     label = 'folder'
     port = 0
+    workers = 1
 
 
 @pytest.fixture()
@@ -91,15 +110,33 @@ def http_request(path, body='', get=False, as_bytes=False):
     return request.encode() if as_bytes else request
 
 
+def http_chunked_body(sock, data):
+    """Return all HTTP message body (sent using chunked transfer encoding)."""
+    body = b''
+    while True:
+        while b"\r\n" not in data:
+            data += sock.recv(RECV_BUFFER)
+        size, _, data = data.partition(b"\r\n")
+        size = int(size, 16)
+        while len(data) < size + 2:
+            data += sock.recv(RECV_BUFFER)
+        if not size:
+            return body.decode()
+        body += data[:size]
+        data = data[size + 2:]
+
+
 def http_response_body(sock):
     """Return all HTTP message body."""
-    data = sock.recv(RECV_BUFFER).decode()
+    data = sock.recv(RECV_BUFFER)
+    if b"Transfer-Encoding: chunked" in data:
+        return http_chunked_body(sock, s.get_http_body(data))
     length = s.get_http_contlength(data)
     body = s.get_http_body(data)
     while len(body) < length and data:
-        data = sock.recv(RECV_BUFFER).decode()
+        data = sock.recv(RECV_BUFFER)
         body += data
-    return body  # url_decode(body)
+    return body.decode()  # url_decode(body)
 
 
 def send_http_request(path, body='', get=False, json_rsp=True):
@@ -121,9 +158,87 @@ def test_http_helper_functions():
     request_body = "the body"
     assert s.parse_and_sanitize("../../a/path/../../")[0][-17:] == "a/path/index.html"
     assert s.parse_and_sanitize("/")[0][-10:] == "index.html"
-    assert s.get_http_path(http_request(request_path)) == request_path
-    assert s.get_http_body(http_request("", request_body)) == request_body
-    assert s.get_http_contlength(http_request("", request_body)) == len(request_body)
+    request = http_request(request_path, request_body, as_bytes=True)
+    assert s.get_http_path(request) == request_path
+    assert s.get_http_body(request) == request_body.encode()
+    assert s.get_http_contlength(request) == len(request_body)
+    assert s.get_http_contlength(b"GET / HTTP/1.1\r\n\r\nContent-Length: 10") == 0
+    assert s.get_http_connection(b"GET / HTTP/1.1\r\nconnection: Close\r\n\r\n") == "close"
+    assert s.get_http_connection(request) == ""
+    request_get = b'GET / HTTP/1.1\r\nIf-None-Match: "etag"\r\n\r\nIf-None-Match: x'
+    assert s.get_http_if_none_match(request_get) == b'"etag"'
+    assert s.get_http_if_none_match(request_get, request_get.find(b"\r\n\r\n")) == b'"etag"'
+    assert s.get_http_if_none_match(request) == b''
+
+    method, rsc_path, version, headers, body_start = s.parse_http_request(request)
+    assert (method, rsc_path, version) == ("POST", request_path, "HTTP/1.1")
+    assert headers == {"content-length": str(len(request_body))}
+    assert request[body_start:] == request_body.encode()
+
+
+def test_classify_docs(mocker):
+    """Test the (multi-process) classification of the test documents."""
+    if not PYTHON3:
+        return
+
+    start_method = multiprocessing.get_start_method(allow_none=True)
+    mocker.patch.object(s, "cpu_count").return_value = 2
+    mocker.patch.object(s, "MIN_DOCS_PER_PROCESS", 1)
+    fork_pool = mocker.spy(s, "fork_pool")
+    results = LT.__classify_docs__(x_train)
+    assert fork_pool.spy_return is not None
+    assert len(results) == len(x_train)
+    assert [r[0][0] for r in results] == [clf.classify(doc)[0][0] for doc in x_train]
+    # the default start method is left untouched
+    assert multiprocessing.get_start_method(allow_none=True) == start_method
+
+    # no processes are forked while the server is serving requests
+    fork_pool.reset_mock()
+    mocker.patch.object(LT, "__serving__", {"event loop"})
+    assert LT.__classify_docs__(x_train) == results
+    assert not fork_pool.called
+
+
+def test_set_testset():
+    """Test the set_testset() function."""
+    assert LT.set_testset([])
+    assert list(LT.__docs__) == [""]
+    assert LT.set_testset(x_train)
+    assert len(LT.__docs__[""].path) == len(x_train)
+    with pytest.raises(IndexError):
+        LT.set_testset(x_train, y_train[:-1])
+
+
+def test_workers():
+    """Test the server with multiple worker processes."""
+    if not PYTHON3 or not hasattr(os, "fork"):
+        return
+
+    server = subprocess.Popen([sys.executable, "-c", WORKERS_SCRIPT],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        line = server.stdout.readline()
+        while line and not line.startswith("PORT"):
+            line = server.stdout.readline()
+        port = int(line.split()[1])
+
+        for _ in range(8):
+            sock = socket.create_connection((ADDRESS, port))
+            sock.sendall(http_request("/ack", as_bytes=True))
+            assert sock.recv(RECV_BUFFER).startswith(b"HTTP/1.1 200 OK")
+            sock.close()
+
+        # only the main process is interrupted, it must stop the workers
+        time.sleep(.5)
+        server.send_signal(signal.SIGINT)
+        output = server.communicate(timeout=30)[0]
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+    assert output.count("AFTER SERVE") == 1
+    with pytest.raises(socket.error):
+        socket.create_connection((ADDRESS, port))
 
 
 def test_live_test(test_case):
@@ -183,6 +298,57 @@ def test_live_test(test_case):
     # ack
     send_http_request("/ack")
 
+    # pipelined requests (sent at once, over the same connection)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(http_request("/ack", as_bytes=True) * 2 + http_request("/ack", "a", as_bytes=True))
+    data = b''
+    while data.count(b"HTTP/1.1 200 OK") < 3:
+        data += sock.recv(RECV_BUFFER)
+    sock.close()
+
+    # slow clients (incomplete bodies) don't block the server
+    slow_socks = []
+    for _ in range(s.cpu_count() + 2):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((ADDRESS, PORT))
+        sock.sendall(b"POST /ack HTTP/1.1\r\nContent-Length: 100\r\n\r\nab")
+        slow_socks.append(sock)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert "<html>" in http_response_body(sock)
+    sock.close()
+    slow_socks[0].sendall(b"c" * 98)  # the rest of the body
+    slow_socks[0].settimeout(5)
+    assert slow_socks[0].recv(RECV_BUFFER).startswith(b"HTTP/1.1 200 OK")
+    for sock in slow_socks:
+        sock.close()
+
+    # request headers split across multiple packets
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ADDRESS, PORT))
+    request = http_request("/get_info", as_bytes=True)
+    sock.sendall(request[:10])
+    time.sleep(.05)
+    sock.sendall(request[10:])
+    assert json.loads(http_response_body(sock))["model_name"] == clf.get_name()
+
+    # keep-alive (the same connection is re-used)
+    sock.sendall(request)
+    assert json.loads(http_response_body(sock))["model_name"] == clf.get_name()
+    sock.close()
+
+    # connection closed by the server
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert "<html>" in http_response_body(sock)
+    assert sock.recv(RECV_BUFFER) == b''
+    sock.close()
+
     # get_info
     r = send_http_request("/get_info")
     assert r["model_name"] == clf.get_name()
@@ -198,6 +364,31 @@ def test_live_test(test_case):
         "this is an android mobile " * (1024 * 4 if test_case == 0 else 1)
     )
     assert r["ci"][r["cvns"][0][0]] == "science&technology"
+    assert r == json.loads(json.dumps(clf.classify(
+        "this is an android mobile " * (1024 * 4 if test_case == 0 else 1), json=True
+    )))
+
+    # classify (cached result, or streamed again if the document is long)
+    assert r == send_http_request(
+        "/classify",
+        "this is an android mobile " * (1024 * 4 if test_case == 0 else 1)
+    )
+
+    # classify (empty document, no partial "200 OK" response is sent)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(http_request("/classify", as_bytes=True))
+    assert sock.recv(RECV_BUFFER) == b''
+    sock.close()
+
+    # classify (HTTP/1.0, no chunked transfer encoding)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(b"POST /classify HTTP/1.0\r\nContent-Length: 7\r\n\r\nandroid")
+    r = json.loads(http_response_body(sock))
+    assert r["ci"][r["cvns"][0][0]] == "science&technology"
+    sock.close()
 
     # get_doc
     for c in docs:
@@ -211,6 +402,18 @@ def test_live_test(test_case):
     r = send_http_request("/", get=True, json_rsp=False)
     assert "<html>" in r
 
+    # GET index.html (not modified, 304)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+    etag = sock.recv(RECV_BUFFER).split(b"ETag: ")[1].split(b"\r\n")[0]
+    sock.close()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ADDRESS, PORT))
+    sock.sendall(b"GET / HTTP/1.1\r\nIf-None-Match: " + etag + b"\r\n\r\n")
+    assert sock.recv(RECV_BUFFER).startswith(b"HTTP/1.1 304 Not Modified\r\n")
+    sock.close()
+
 
 def test_main(mockers, mocker):
     """Test the main() function."""